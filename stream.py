@@ -1,17 +1,27 @@
 import pandas as pd
-from bs4 import BeautifulSoup
 import streamlit as st
 import zipfile
 import uuid
 import shutil
+import atexit
+import tempfile
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
 from pathlib import Path
 import os
 import json
+import hashlib
+import fnmatch
+import re
+import html
 import datetime
 import time
-from io import BytesIO
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
 # ------------------------------
 # Streamlit Page Configuration & Branding
 # ------------------------------
@@ -83,127 +93,152 @@ st.markdown("""
 # ------------------------------
 
 
-def generate_dcm2bids_config(temp_dir: Path) -> Path:
-    config = {
-        "descriptions": [
-            # Anatomical Imaging
-            {
-                "datatype": "anat",
-                "suffix": "T1w",
-                "criteria": {
-                    "SeriesDescription": "*T1*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERMANY|OTHER).*"]
-                },
-                "sidecar_changes": {"ProtocolName": "T1w"}
+# dcm2bids runs dcm2niix with "-z y", which compresses NIfTIs with pigz on
+# all cores when pigz is installed (see packages.txt) and miniz otherwise
+_DCM2BIDS_CONFIG = {
+    "descriptions": [
+        # Anatomical Imaging
+        {
+            "datatype": "anat",
+            "suffix": "T1w",
+            "criteria": {
+                "SeriesDescription": "*T1*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERMANY|OTHER).*"]
             },
-            {
-                "datatype": "anat",
-                "suffix": "T2w",
-                "criteria": {
-                    "SeriesDescription": "*T2*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERMANY).*"]
-                },
-                "sidecar_changes": {"ProtocolName": "T2w"}
+            "sidecar_changes": {"ProtocolName": "T1w"}
+        },
+        {
+            "datatype": "anat",
+            "suffix": "T2w",
+            "criteria": {
+                "SeriesDescription": "*T2*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERMANY).*"]
             },
-            {
-                "datatype": "anat",
-                "suffix": "FLAIR",
-                "criteria": {
-                    "SeriesDescription": "*FLAIR*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERMANY).*"]
-                }
-            },
-
-            # Functional Imaging
-            {
-                "datatype": "func",
-                "suffix": "bold",
-                "criteria": {
-                    "SeriesDescription": "*BOLD*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|FMRI|OTHER).*"]
-                },
-                "sidecar_changes": {"TaskName": "rest"}
-            },
-            {
-                "datatype": "func",
-                "suffix": "sbref",
-                "criteria": {
-                    "SeriesDescription": "*SBRef*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|FMRI|OTHER).*"]
-                }
-            },
-
-            # Diffusion Imaging
-            {
-                "datatype": "dwi",
-                "suffix": "dwi",
-                "criteria": {
-                    "SeriesDescription": "*DWI*|*DTI*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|DIFFUSION).*"]
-                },
-                "sidecar_changes": {
-                    "PhaseEncodingDirection": "j",
-                    "TotalReadoutTime": 0.028
-                }
-            },
-
-            # Field Maps
-            {
-                "datatype": "fmap",
-                "suffix": "phasediff",
-                "criteria": {
-                    "SeriesDescription": "*FMRI_DISTORTION*",
-                    "ImageType": ["ORIGINAL", "(?i).*(P|PHASE).*"]
-                }
-            },
-            {
-                "datatype": "fmap",
-                "suffix": "magnitude",
-                "criteria": {
-                    "SeriesDescription": "*FMRI_DISTORTION*",
-                    "ImageType": ["ORIGINAL", "(?i).*(M|MAG).*"]
-                }
+            "sidecar_changes": {"ProtocolName": "T2w"}
+        },
+        {
+            "datatype": "anat",
+            "suffix": "FLAIR",
+            "criteria": {
+                "SeriesDescription": "*FLAIR*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERMANY).*"]
+            }
+        },
+
+        # Functional Imaging
+        {
+            "datatype": "func",
+            "suffix": "bold",
+            "criteria": {
+                "SeriesDescription": "*BOLD*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|FMRI|OTHER).*"]
             },
-
-            # Perfusion Imaging
-            {
-                "datatype": "perf",
-                "suffix": "asl",
-                "criteria": {
-                    "SeriesDescription": "*ASL*|*Perfusion*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERFUSION).*"]
-                }
+            "sidecar_changes": {"TaskName": "rest"}
+        },
+        {
+            "datatype": "func",
+            "suffix": "sbref",
+            "criteria": {
+                "SeriesDescription": "*SBRef*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|FMRI|OTHER).*"]
+            }
+        },
+
+        # Diffusion Imaging
+        {
+            "datatype": "dwi",
+            "suffix": "dwi",
+            "criteria": {
+                "SeriesDescription": "*DWI*|*DTI*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|DIFFUSION).*"]
             },
-
-            # Task-Based fMRI(Example for different tasks)
-            {
-                "datatype": "func",
-                "suffix": "bold",
-                "criteria": {
-                    "SeriesDescription": "*Nback*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|FMRI).*"]
-                },
-                "sidecar_changes": {"TaskName": "nback"}
+            "sidecar_changes": {
+                "PhaseEncodingDirection": "j",
+                "TotalReadoutTime": 0.028
+            }
+        },
+
+        # Field Maps
+        {
+            "datatype": "fmap",
+            "suffix": "phasediff",
+            "criteria": {
+                "SeriesDescription": "*FMRI_DISTORTION*",
+                "ImageType": ["ORIGINAL", "(?i).*(P|PHASE).*"]
+            }
+        },
+        {
+            "datatype": "fmap",
+            "suffix": "magnitude",
+            "criteria": {
+                "SeriesDescription": "*FMRI_DISTORTION*",
+                "ImageType": ["ORIGINAL", "(?i).*(M|MAG).*"]
+            }
+        },
+
+        # Perfusion Imaging
+        {
+            "datatype": "perf",
+            "suffix": "asl",
+            "criteria": {
+                "SeriesDescription": "*ASL*|*Perfusion*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|PERFUSION).*"]
+            }
+        },
+
+        # Task-Based fMRI(Example for different tasks)
+        {
+            "datatype": "func",
+            "suffix": "bold",
+            "criteria": {
+                "SeriesDescription": "*Nback*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|FMRI).*"]
             },
-
-            # Multi-echo Sequences
-            {
-                "datatype": "anat",
-                "suffix": "MESE",
-                "criteria": {
-                    "SeriesDescription": "*MultiEcho*",
-                    "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|MULTIECHO).*"]
-                }
+            "sidecar_changes": {"TaskName": "nback"}
+        },
+
+        # Multi-echo Sequences
+        {
+            "datatype": "anat",
+            "suffix": "MESE",
+            "criteria": {
+                "SeriesDescription": "*MultiEcho*",
+                "ImageType": ["ORIGINAL", "(?i).*(PRIMARY|MULTIECHO).*"]
             }
-        ],
-        "default_entities": {
-            "subject": "{subject}",
-            "session": "{session}"
         }
+    ],
+    "default_entities": {
+        "subject": "{subject}",
+        "session": "{session}"
     }
-    config_file = temp_dir / "dcm2bids_config.json"
-    with open(config_file, 'w') as f:
-        json.dump(config, f, indent=4)
+}
+
+
+@st.cache_resource
+def _dcm2bids_config_bytes() -> bytes:
+    # The script re-executes on every rerun, so serialize once per process
+    return json.dumps(_DCM2BIDS_CONFIG, indent=4).encode("utf-8")
+
+
+@st.cache_resource
+def _dcm2bids_config_path() -> Path:
+    # mkdtemp gives a 0700 directory only this process can write to, so nobody
+    # else can plant a config at the path; named after its content so an
+    # edited config never reuses a stale file
+    config_dir = Path(tempfile.mkdtemp(prefix="webqc_config_"))
+    atexit.register(shutil.rmtree, config_dir, ignore_errors=True)
+    digest = hashlib.sha1(_dcm2bids_config_bytes()).hexdigest()[:12]
+    return config_dir / f"dcm2bids_config_{digest}.json"
+
+
+def generate_dcm2bids_config(temp_dir: Path = None) -> Path:
+    # The config is the same for every job, so all jobs share one copy;
+    # temp_dir is accepted for existing callers but no longer needed
+    config_file = _dcm2bids_config_path()
+    if not config_file.exists():
+        staging = config_file.with_name(f"{config_file.name}.{uuid.uuid4().hex[:8]}")
+        staging.write_bytes(_dcm2bids_config_bytes())
+        os.replace(staging, config_file)
     return config_file
 
 
@@ -213,11 +248,42 @@ def run_dcm2bids(dicom_dir: Path, bids_out: Path, subj_id: str, ses_id: str, con
     if ses_id:
         cmd += ["-s", ses_id]
     st.write(f"**Running**: `{' '.join(cmd)}`")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        st.error(f"dcm2bids error:\n{result.stderr}")
-    else:
-        st.success("dcm2bids completed successfully.")
+    # Show the log as dcm2bids writes it; keep only the tail so each redraw is bounded
+    log_view = st.empty()
+    log_lines = collections.deque(maxlen=200)
+    log_lock = threading.Lock()
+
+    def pump(stream):
+        for line in stream:
+            with log_lock:
+                log_lines.append(line)
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          text=True) as proc:
+        reader = threading.Thread(target=pump, args=(proc.stdout,), daemon=True)
+        reader.start()
+        # Redraw on a timer rather than per line: a few deltas a second at most,
+        # and the latest lines still show while dcm2niix goes quiet
+        drawn = None
+        while True:
+            reader.join(0.25)
+            with log_lock:
+                tail = "".join(log_lines)
+            if tail != drawn:
+                log_view.code(tail)
+                drawn = tail
+            if not reader.is_alive():
+                break
+    if proc.returncode != 0:
+        st.error(f"dcm2bids error:\n{''.join(log_lines)}")
+        return False
+    st.success("dcm2bids completed successfully.")
+    return True
+
+
+# Lookahead so overlapping keywords (e.g. "bold" + "dti" in "boldti") all match
+_MODALITY_RE = re.compile(
+    r"(?=(t1|t2|flair|fluid|dwi|dti|bold|fmri|functional|activation|asl|perfusion))")
 
 
 def classify_from_metadata(meta):
@@ -235,26 +301,55 @@ def classify_from_metadata(meta):
             meta.get("ProtocolName", "")).lower()
     pulse = meta.get("PulseSequenceName", "").lower()
 
-    if "t1" in desc and "flair" not in desc:
+    # One regex scan collects every keyword; the precedence below is unchanged
+    found = set(_MODALITY_RE.findall(desc))
+    if "t1" in found and "flair" not in found:
         return "anat", "T1w"
-    elif "t2" in desc:
+    elif "t2" in found:
         return "anat", "T2w"
-    elif "flair" in desc or "fluid" in desc:
+    elif found & {"flair", "fluid"}:
         return "anat", "FLAIR"
-    elif "dwi" in desc or "dti" in desc:
+    elif found & {"dwi", "dti"}:
         return "dwi", "dwi"
-    elif "bold" in desc or "fmri" in desc or "functional" in desc or "activation" in desc or "epi" in pulse:
+    elif found & {"bold", "fmri", "functional", "activation"} or "epi" in pulse:
         return "func", "bold"
-    elif "asl" in desc or "perfusion" in desc:
+    elif found & {"asl", "perfusion"}:
         return "perf", "asl"
     else:
         return None, None
 
 
-def classify_and_move_original_files(bids_out: Path, subj_id: str, ses_id: str):
+def _move_file(move):
+    src, dst = move
+    try:
+        os.replace(src, dst)
+    except OSError:
+        # os.replace cannot cross filesystems; shutil.move copies instead
+        try:
+            shutil.move(str(src), str(dst))
+        except OSError as exc:
+            return f"{src.name}: {exc}"
+    return None
+
+
+def _async_rmtree(path: Path, trash_dir: Path):
+    # Move the tree out of the way first (one rename) so later steps never
+    # see it half-deleted, then unlink its files off the script thread
+    trash = trash_dir / f".trash_{uuid.uuid4().hex[:8]}"
+    try:
+        os.replace(path, trash)
+    except OSError:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    threading.Thread(target=shutil.rmtree, args=(trash,),
+                     kwargs={"ignore_errors": True}, daemon=True).start()
+
+
+def classify_and_move_original_files(bids_out: Path, subj_id: str, ses_id: str) -> bool:
+    # Returns False when some pairs could not be moved into place
     tmp_folder = bids_out / "tmp_dcm2bids" / f"sub-{subj_id}_ses-{ses_id}"
     if not tmp_folder.exists():
-        return
+        return True
 
     sub_dir = bids_out / f"sub-{subj_id}"
     ses_dir = sub_dir / f"ses-{ses_id}" if ses_id else sub_dir
@@ -267,8 +362,26 @@ def classify_and_move_original_files(bids_out: Path, subj_id: str, ses_id: str):
         "perf": ses_dir / "perf"
     }
 
+    # Index sidecars and images in a single walk so partners are dict lookups
+    json_files = []
+    nifti_files = {}
+    for root, _, names in os.walk(tmp_folder):
+        root = Path(root)
+        for name in names:
+            if name.endswith(".json"):
+                json_files.append(root / name)
+            elif name.endswith(".nii.gz"):
+                nifti_files[(root, name[:-7])] = root / name
+            elif name.endswith(".nii"):
+                nifti_files.setdefault((root, name[:-4]), root / name)
+
+    # Modality folders are created on first use so no empty ones are left
+    created_dirs = set()
+    pairs = {}
+    name_prefix = f"sub-{subj_id}_ses-{ses_id}" if ses_id else f"sub-{subj_id}"
+
     # Loop over JSON sidecars only
-    for json_file in tmp_folder.rglob("*.json"):
+    for json_file in json_files:
         try:
             with open(json_file, "r") as jf:
                 meta = json.load(jf)
@@ -285,75 +398,72 @@ def classify_and_move_original_files(bids_out: Path, subj_id: str, ses_id: str):
             continue
 
         # Determine modality from metadata
-        desc = (meta.get("SeriesDescription", "") + " " +
-                meta.get("ProtocolName", "")).lower()
-        pulse = meta.get("PulseSequenceName", "").lower()
-
-        if "t1" in desc and "flair" not in desc:
-            modality, suffix = "anat", "T1w"
-        elif "t2" in desc:
-            modality, suffix = "anat", "T2w"
-        elif "flair" in desc or "fluid" in desc:
-            modality, suffix = "anat", "FLAIR"
-        elif "dwi" in desc or "dti" in desc:
-            modality, suffix = "dwi", "dwi"
-        elif "bold" in desc or "fmri" in desc or "functional" in desc or "activation" in desc or "epi" in pulse:
-            modality, suffix = "func", "bold"
-        elif "asl" in desc or "perfusion" in desc:
-            modality, suffix = "perf", "asl"
-        else:
+        modality, suffix = classify_from_metadata(meta)
+        if modality is None:
             st.info(f"Unclassified: {json_file.name}")
             continue
 
         # Locate matching NIfTI image
-        nii_file = json_file.with_suffix(".nii.gz")
-        if not nii_file.exists():
-            nii_file = json_file.with_suffix(".nii")
-        if not nii_file.exists():
+        nii_file = nifti_files.get((json_file.parent, json_file.stem))
+        if nii_file is None:
             st.warning(f"No matching NIfTI for: {json_file.name}")
             continue
 
         target_dir = modality_paths[modality]
-        target_dir.mkdir(parents=True, exist_ok=True)
+        if modality not in created_dirs:
+            target_dir.mkdir(parents=True, exist_ok=True)
+            created_dirs.add(modality)
 
         # Compose filenames
-        base_name = f"sub-{subj_id}"
-        if ses_id:
-            base_name += f"_ses-{ses_id}"
-        base_name += f"_{suffix}"
+        base_name = f"{name_prefix}_{suffix}"
 
         new_json_path = target_dir / f"{base_name}.json"
         new_nii_path = target_dir / (f"{base_name}.nii.gz")
 
-        # Move both
-        shutil.move(str(json_file), str(new_json_path))
-        shutil.move(str(nii_file), str(new_nii_path))
+        # A later series with the same target replaces the earlier one
+        pairs[new_json_path] = (json_file, nii_file, new_nii_path)
+
+    # Renames are independent metadata operations, so issue them concurrently
+    moves = []
+    for new_json_path, (json_file, nii_file, new_nii_path) in pairs.items():
+        moves += [(json_file, new_json_path), (nii_file, new_nii_path)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        failures = [err for err in executor.map(_move_file, moves) if err]
+
+    if failures:
+        for err in failures:
+            st.warning(f"Could not move {err}")
+        st.warning(f"Kept {tmp_folder.parent} for inspection.")
+        return False
+
+    for new_json_path, (_, _, new_nii_path) in pairs.items():
         st.success(f"Moved: {new_json_path.name} and {new_nii_path.name}")
 
     # Cleanup
-    shutil.rmtree(tmp_folder.parent, ignore_errors=True)
+    _async_rmtree(tmp_folder.parent, bids_out.parent)
     st.info("Finished organizing ORIGINAL NIfTI + JSON pairs.")
+    return True
 
 
 # This line replaces your old move_files_in_tmp()
 move_files_in_tmp = classify_and_move_original_files
 
 
-def create_bids_top_level_files(bids_dir: Path, subject_id: str):
-    dd_file = bids_dir / "dataset_description.json"
-    if not dd_file.exists():
-        dataset_description = {
-            "Name": "Example dataset",
-            "BIDSVersion": "1.6.0",
-            "License": "CC0",
-            "Authors": ["Philip Nkwam", "Udunna Anazodo", "Maruf Adewole", "Sekinat Aderibigbe"],
-            "DatasetType": "raw"
-        }
-        with open(dd_file, 'w') as f:
-            json.dump(dataset_description, f, indent=4)
-    readme_file = bids_dir / "README"
-    if not readme_file.exists():
-        content = f"""\
+_DATASET_DESCRIPTION = {
+    "Name": "Example dataset",
+    "BIDSVersion": "1.6.0",
+    "License": "CC0",
+    "Authors": ["Philip Nkwam", "Udunna Anazodo", "Maruf Adewole", "Sekinat Aderibigbe"],
+    "DatasetType": "raw"
+}
+
+_PARTICIPANTS_SIDECAR = {
+    "participant_id": {"Description": "Unique ID"},
+    "age": {"Description": "Age in years"},
+    "sex": {"Description": "Biological sex"}
+}
+
+_BIDS_README = """\
 # BIDS Dataset
 
 This dataset was automatically generated by dcm2bids.
@@ -366,60 +476,300 @@ This dataset was automatically generated by dcm2bids.
 
 Please see the official [BIDS documentation](https://bids.neuroimaging.io) for details.
 """
-        with open(readme_file, 'w') as f:
-            f.write(content)
-    changes_file = bids_dir / "CHANGES"
-    if not changes_file.exists():
-        content = f"1.0.0 {datetime.datetime.now().strftime('%Y-%m-%d')}\n  - Initial BIDS conversion\n"
-        with open(changes_file, 'w') as f:
+
+
+@st.cache_resource
+def _bids_top_level_json():
+    return (json.dumps(_DATASET_DESCRIPTION, indent=4).encode("utf-8"),
+            json.dumps(_PARTICIPANTS_SIDECAR, indent=4).encode("utf-8"))
+
+
+def create_bids_top_level_files(bids_dir: Path, subject_id: str):
+    dataset_description, participants_sidecar = _bids_top_level_json()
+    targets = [
+        ("dataset_description.json", dataset_description),
+        ("README", _BIDS_README.encode("utf-8")),
+        ("CHANGES", f"1.0.0 {datetime.datetime.now().strftime('%Y-%m-%d')}\n"
+                    f"  - Initial BIDS conversion\n".encode("utf-8")),
+        ("participants.tsv", f"participant_id\tage\tsex\n"
+                             f"sub-{subject_id}\tN/A\tN/A\n".encode("utf-8")),
+        ("participants.json", participants_sidecar),
+    ]
+    for name, content in targets:
+        # O_EXCL folds the "already there?" check into the create itself
+        try:
+            fd = os.open(bids_dir / name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            continue
+        with open(fd, "wb") as f:
             f.write(content)
-    participants_tsv = bids_dir / "participants.tsv"
-    if not participants_tsv.exists():
-        with open(participants_tsv, 'w') as f:
-            f.write("participant_id\tage\tsex\n")
-            f.write(f"sub-{subject_id}\tN/A\tN/A\n")
-    participants_json = bids_dir / "participants.json"
-    if not participants_json.exists():
-        pjson = {
-            "participant_id": {"Description": "Unique ID"},
-            "age": {"Description": "Age in years"},
-            "sex": {"Description": "Biological sex"}
-        }
-        with open(participants_json, 'w') as f:
-            json.dump(pjson, f, indent=4)
+
+
+_MRIQC_MODALITIES = ("T1w", "T2w", "bold")
+
+# Converted BIDS archives keyed by upload content, IDs and dcm2bids config
+_BIDS_CACHE_ROOT = Path.home() / ".cache" / "webqc"
+# Entries are patient-derived, so bound both how long and how much is kept
+_BIDS_CACHE_MAX_AGE = 24 * 3600  # seconds since last use
+_BIDS_CACHE_MAX_BYTES = 5 << 30
+
+
+def _prune_bids_cache(keep: Path = None):
+    # Drop entries idle past the age limit, then the least recently used
+    # ones until the archives fit the size budget
+    now = time.time()
+    try:
+        with os.scandir(_BIDS_CACHE_ROOT) as it:
+            entry_dirs = [Path(e.path) for e in it if e.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return
+    entries = []
+    for entry_dir in entry_dirs:
+        if entry_dir == keep:
+            continue
+        try:
+            # Hits touch the archive; a missing one is mid-write or abandoned
+            stat = (entry_dir / "bids_dataset.zip").stat()
+        except FileNotFoundError:
+            try:
+                if now - entry_dir.stat().st_mtime > _BIDS_CACHE_MAX_AGE:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+            continue
+        if now - stat.st_mtime > _BIDS_CACHE_MAX_AGE:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry_dir))
+
+    total = sum(size for _, size, _ in entries)
+    if keep is not None and (keep / "bids_dataset.zip").exists():
+        total += (keep / "bids_dataset.zip").stat().st_size
+    for _, size, entry_dir in sorted(entries):
+        if total <= _BIDS_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+_PRECOMPRESSED_SUFFIXES = (".gz", ".zst", ".xz", ".zip")
+
+
+def detect_bids_modalities(bids_dir: Path):
+    # dcm2bids already read every header; the BIDS filenames say what it found
+    found = set()
+    for _, _, names in os.walk(bids_dir):
+        for name in names:
+            for modality in _MRIQC_MODALITIES:
+                if f"_{modality}.nii" in name:
+                    found.add(modality)
+    return [m for m in _MRIQC_MODALITIES if m in found]
 
 
 def zip_directory(folder_path: Path, zip_file_path: Path):
-    shutil.make_archive(str(zip_file_path.with_suffix("")),
-                        'zip', root_dir=folder_path)
+    zip_file_path = zip_file_path.resolve()
+    zip_file_path.unlink(missing_ok=True)
+    # Info-ZIP stores the -n suffixes and fast-deflates the rest in C
+    if shutil.which("zip"):
+        result = subprocess.run(
+            ["zip", "-q", "-r", "-1", "-n", ":".join(_PRECOMPRESSED_SUFFIXES),
+             str(zip_file_path), "."],
+            cwd=folder_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            return
+        zip_file_path.unlink(missing_ok=True)
+
+    with zipfile.ZipFile(zip_file_path, 'w', compression=zipfile.ZIP_STORED,
+                         allowZip64=True) as zf:
+        for root, _, names in os.walk(folder_path):
+            for name in names:
+                path = os.path.join(root, name)
+                # Store .nii.gz and tiny sidecars; fast-deflate raw .nii and the rest
+                if (name.endswith(_PRECOMPRESSED_SUFFIXES)
+                        or os.path.getsize(path) < 4096):
+                    zf.write(path, os.path.relpath(path, folder_path))
+                else:
+                    zf.write(path, os.path.relpath(path, folder_path),
+                             compress_type=zipfile.ZIP_DEFLATED,
+                             compresslevel=1)
+
+
+# OS metadata that zip tools add to uploads; never worth writing to disk
+_ARCHIVE_JUNK = ("__MACOSX/*", "*.DS_Store", "._*", "*/._*", "*Thumbs.db")
+
+
+def extract_zip(zip_source, dest_dir: Path):
+    # unzip is far faster than zipfile on archives of many small slices
+    if isinstance(zip_source, Path) and shutil.which("unzip"):
+        result = subprocess.run(
+            ["unzip", "-q", "-o", str(zip_source), "-d", str(dest_dir),
+             "-x", *_ARCHIVE_JUNK],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode in (0, 1):  # 1 = completed with warnings
+            return
+
+    with zipfile.ZipFile(zip_source, 'r') as zf:
+        members, dirs = [], set()
+        for info in zf.infolist():
+            if any(fnmatch.fnmatchcase(info.filename, pattern)
+                   for pattern in _ARCHIVE_JUNK):
+                continue
+            name = os.path.normpath(info.filename)
+            # Refuse entries that would land outside dest_dir
+            if os.path.isabs(name) or name == ".." or name.startswith(".." + os.sep):
+                continue
+            dest = dest_dir / name
+            if info.is_dir():
+                dirs.add(dest)
+            elif info.file_size:
+                members.append((info, dest))
+                dirs.add(dest.parent)
+
+        # One mkdir per distinct directory rather than one per entry
+        for parent in sorted(dirs):
+            parent.mkdir(parents=True, exist_ok=True)
+
+        for info, dest in members:
+            with zf.open(info) as src, open(dest, 'wb', buffering=0) as dst:
+                shutil.copyfileobj(src, dst, min(info.file_size, 1 << 20))
+
+
+_IQMS_TABLE_RE = re.compile(rb"""<table[^>]*\bid=["']iqms-table["']""", re.I)
+_IQMS_CELL = rb"<td[^>]*>((?:(?!</td>).)*)</td>"
+_IQMS_ROW_RE = re.compile(
+    rb"<tr[^>]*>\s*" + _IQMS_CELL + rb"\s*" + _IQMS_CELL + rb"\s*</tr>", re.I | re.S)
+_HTML_TAG_RE = re.compile(rb"<[^>]+>")
+
+
+def _cell_text(cell: bytes) -> str:
+    text = _HTML_TAG_RE.sub(b"", cell).decode("utf-8", errors="replace")
+    return html.unescape(text).strip()
 
 
 def extract_iqms_from_html(html_file: Path):
     iqms = {}
-    with open(html_file, 'r', encoding='utf-8') as file:
-        soup = BeautifulSoup(file, 'html.parser')
-
-    iqm_table = soup.find("table", {"id": "iqms-table"})
-    if iqm_table:
-        rows = iqm_table.find_all("tr")
-        for row in rows:
-            cols = row.find_all("td")
-            if len(cols) == 2:
-                metric_name = cols[0].get_text(strip=True)
-                metric_value = cols[1].get_text(strip=True)
-                iqms[metric_name] = metric_value
+    data = html_file.read_bytes()
+
+    # Only scan the iqms-table, rows with exactly two cells
+    table = _IQMS_TABLE_RE.search(data)
+    if table:
+        end = data.find(b"</table>", table.end())
+        chunk = data[table.end():end if end != -1 else len(data)]
+        for row in _IQMS_ROW_RE.finditer(chunk):
+            iqms[_cell_text(row.group(1))] = _cell_text(row.group(2))
 
     return iqms
 
 
 def extract_all_iqms(result_dir: Path):
-    iqm_list = []
-    html_reports = list(result_dir.rglob("*.html"))
-    for html_file in html_reports:
+    reports = []
+    metric_names = {}
+    for html_file in result_dir.rglob("*.html"):
         iqms = extract_iqms_from_html(html_file)
-        iqms["Report Filename"] = html_file.name
-        iqm_list.append(iqms)
-    return pd.DataFrame(iqm_list)
+        metric_names.update(dict.fromkeys(iqms))
+        reports.append((html_file.name, iqms))
+
+    # Fix the schema once so pandas does not have to unify keys per row
+    columns = list(metric_names)
+    rows = [tuple(iqms.get(name) for name in columns) + (report_name,)
+            for report_name, iqms in reports]
+    df = pd.DataFrame.from_records(rows, columns=columns + ["Report Filename"])
+
+    # Give metric columns a numeric dtype when every value parses
+    for name in columns:
+        numeric = pd.to_numeric(df[name], errors="coerce")
+        if numeric.count() == df[name].count():
+            df[name] = numeric
+    return df
+
+
+def _session_temp_dir() -> Path:
+    # One scratch tree per browser session, emptied before each conversion
+    first_use = "sid" not in st.session_state
+    if first_use:
+        st.session_state.sid = uuid.uuid4().hex[:8]
+    temp_dir = Path(tempfile.gettempdir()) / f"webqc_{st.session_state.sid}"
+    if first_use:
+        atexit.register(shutil.rmtree, temp_dir, ignore_errors=True)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    return temp_dir
+
+
+@st.cache_resource
+def _session() -> requests.Session:
+    # One pooled keep-alive session per process, shared across reruns
+    session = requests.Session()
+    # Retry only failed connects: the streamed upload cannot be replayed, and
+    # a 5xx after a long MRIQC run should not silently resubmit the job
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4,
+                          max_retries=Retry(total=3, backoff_factor=0.5))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _start_mriqc_job(*args):
+    # Runs the MRIQC round-trip off the script thread so reruns stay responsive.
+    # One worker per submission: runs never queue behind other sessions' jobs
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mriqc")
+    future = executor.submit(_run_mriqc_job, *args)
+    executor.shutdown(wait=False)
+    return future
+
+
+def _run_mriqc_job(session: requests.Session, url: str, bids_zip_path: Path,
+                   data: dict, result_zip_path: Path, progress: dict) -> dict:
+    # Worker thread: no st.* calls here, progress is reported through the dict
+    def on_upload(monitor):
+        # map 10->45% while the archive is being sent
+        progress["pct"] = 10 + 35 * monitor.bytes_read // max(monitor.len, 1)
+        if monitor.bytes_read >= monitor.len:
+            progress["stage"] = "Processing on server... This may take several minutes."
+
+    with open(bids_zip_path, 'rb') as bids_fh:
+        # Stream the multipart body instead of building it in memory
+        encoder = MultipartEncoder(fields={
+            **data,
+            'bids_zip': ('bids_dataset.zip', bids_fh, 'application/zip')
+        })
+        monitor = MultipartEncoderMonitor(encoder, on_upload)
+        response = session.post(
+            url,
+            data=monitor,
+            headers={'Content-Type': monitor.content_type},
+            timeout=(120, 7200),
+            stream=True
+        )
+
+    # Closing the response hands the pooled connection back
+    with response:
+        if response.status_code != 200:
+            # try to keep structured detail if available
+            try:
+                detail = response.json().get("detail")
+            except Exception:
+                detail = None
+            return {"status": response.status_code, "detail": detail,
+                    "text": response.text[:800]}
+
+        progress["pct"] = 50
+        progress["stage"] = "Processing completed, downloading results..."
+
+        total = int(response.headers.get("Content-Length") or 0)
+        downloaded = 0
+        with open(result_zip_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                if total:
+                    downloaded += len(chunk)
+                    # map 50->95% during download
+                    progress["pct"] = min(50 + int(45 * (downloaded / total)), 95)
+
+        return {"status": 200,
+                "content_type": response.headers.get("content-type", ""),
+                "content_disposition": response.headers.get("content-disposition", "")}
 
 # ------------------------------
 # Main Streamlit App
@@ -434,7 +784,7 @@ def main():
 
     selected_modalities = st.multiselect(
         "Select MRIQC modalities:",
-        ["T1w", "T2w", "bold"],
+        list(_MRIQC_MODALITIES),
         default=["T1w"]
     )
 
@@ -450,30 +800,79 @@ def main():
     dicom_zip = st.file_uploader("Upload DICOM ZIP", type=["zip"])
 
     if dicom_zip:
-        if st.button("Run DICOM → BIDS Conversion"):
+        run_conversion = st.button("Run DICOM → BIDS Conversion")
+        job = st.session_state.get("mriqc_job")
+        if run_conversion and job is not None and not job.done():
+            # The running job reads its upload from, and writes into, the scratch dir
+            st.warning("Wait for the running MRIQC job to finish before converting again.")
+            run_conversion = False
+        if run_conversion:
             with st.spinner("Converting DICOM to BIDS..."):
-                job_id = str(uuid.uuid4())[:8]
-                temp_dir = Path(f"temp_{job_id}")
-                temp_dir.mkdir(exist_ok=True)
-
-                dicom_dir = temp_dir / "dicoms"
-                dicom_dir.mkdir(exist_ok=True)
-                with zipfile.ZipFile(dicom_zip, 'r') as zf:
-                    zf.extractall(dicom_dir)
-                st.success(f"DICOMs extracted to {dicom_dir}")
-
-                bids_out = temp_dir / "bids_output"
-                bids_out.mkdir(exist_ok=True)
-
-                config_file = generate_dcm2bids_config(temp_dir)
-                run_dcm2bids(dicom_dir, bids_out, subj_id, ses_id, config_file)
-
-                classify_and_move_original_files(bids_out, subj_id, ses_id)
-                create_bids_top_level_files(bids_out, subj_id)
-
-                bids_zip_path = temp_dir / "bids_dataset.zip"
-                zip_directory(bids_out, bids_zip_path)
-                st.success("DICOM to BIDS conversion complete!")
+                temp_dir = _session_temp_dir()
+                # Resetting the scratch dir removed the previous MRIQC results too
+                st.session_state.pop("mriqc_job", None)
+                st.session_state.pop("mriqc_reports", None)
+
+                # Hash the upload while spooling it; the bytes pass through anyway
+                upload_zip = temp_dir / "upload.zip"
+                upload_hash = hashlib.blake2b(digest_size=16)
+                dicom_zip.seek(0)
+                with open(upload_zip, 'wb') as dst:
+                    for chunk in iter(lambda: dicom_zip.read(1 << 20), b""):
+                        upload_hash.update(chunk)
+                        dst.write(chunk)
+                # The BIDS output also depends on the IDs and the dcm2bids config
+                upload_hash.update(f"\0{subj_id}\0{ses_id}\0".encode("utf-8"))
+                upload_hash.update(_dcm2bids_config_bytes())
+                cache_dir = _BIDS_CACHE_ROOT / upload_hash.hexdigest()
+                bids_zip_path = cache_dir / "bids_dataset.zip"
+                _prune_bids_cache()
+
+                if bids_zip_path.exists():
+                    st.success("This upload was converted before; reusing the cached BIDS dataset.")
+                    # Mark the entry as recently used for pruning
+                    os.utime(bids_zip_path)
+                    detected = json.loads(
+                        (cache_dir / "modalities.json").read_text())
+                else:
+                    dicom_dir = temp_dir / "dicoms"
+                    dicom_dir.mkdir(exist_ok=True)
+                    extract_zip(upload_zip, dicom_dir)
+                    st.success(f"DICOMs extracted to {dicom_dir}")
+
+                    bids_out = temp_dir / "bids_output"
+                    bids_out.mkdir(exist_ok=True)
+
+                    config_file = generate_dcm2bids_config(temp_dir)
+                    converted = run_dcm2bids(
+                        dicom_dir, bids_out, subj_id, ses_id, config_file)
+
+                    organized = classify_and_move_original_files(
+                        bids_out, subj_id, ses_id)
+                    create_bids_top_level_files(bids_out, subj_id)
+                    detected = detect_bids_modalities(bids_out)
+
+                    # Only a clean conversion is worth serving to later uploads
+                    if converted and organized:
+                        # Zip into the cache; the final rename marks the entry complete
+                        cache_dir.mkdir(parents=True, exist_ok=True)
+                        (cache_dir / "modalities.json").write_text(json.dumps(detected))
+                        staging = cache_dir / f".{uuid.uuid4().hex[:8]}.zip"
+                        zip_directory(bids_out, staging)
+                        os.replace(staging, bids_zip_path)
+                        _prune_bids_cache(keep=cache_dir)
+                    else:
+                        bids_zip_path = temp_dir / "bids_dataset.zip"
+                        zip_directory(bids_out, bids_zip_path)
+                    st.success("DICOM to BIDS conversion complete!")
+
+                    # Both trees are in the BIDS zip now; don't hold GBs until exit.
+                    # A failed organize keeps bids_out (and its tmp_dcm2bids) for
+                    # inspection until the next conversion
+                    _async_rmtree(dicom_dir, temp_dir)
+                    if organized:
+                        _async_rmtree(bids_out, temp_dir)
+                upload_zip.unlink()
 
                 with open(bids_zip_path, "rb") as f:
                     st.download_button(
@@ -483,8 +882,14 @@ def main():
                         mime="application/zip"
                     )
 
+                if detected:
+                    st.info(f"Modalities found in the dataset: `{', '.join(detected)}`")
+                else:
+                    st.warning("No T1w, T2w or bold images were produced.")
+
                 st.session_state.temp_dir = str(temp_dir)
                 st.session_state.bids_zip_path = str(bids_zip_path)
+                st.session_state.detected_modalities = detected
 
         if selected_modalities:
             st.markdown("### ✅ Selected Modalities for MRIQC")
@@ -505,14 +910,22 @@ def main():
                 st.error(f"BIDS zip not found: {bids_zip_path}")
                 st.stop()
 
+            # Don't spend an MRIQC run on modalities the dataset doesn't contain
+            detected = st.session_state.get("detected_modalities")
+            if detected is not None:
+                skipped = [m for m in selected_modalities if m not in detected]
+                if skipped:
+                    st.warning(
+                        f"Not in the converted dataset, skipping: `{', '.join(skipped)}`")
+                selected_modalities = [
+                    m for m in selected_modalities if m in detected]
+                if not selected_modalities:
+                    st.error("None of the selected modalities are in the dataset.")
+                    st.stop()
+
             modalities_str = " ".join(selected_modalities)
             st.info(f"📦 Modalities: {modalities_str}")
 
-            with open(bids_zip_path, 'rb') as f:
-                file_content = f.read()
-
-            files = {'bids_zip': ('bids_dataset.zip',
-                                  file_content, 'application/zip')}
             data = {
                 'participant_label': subj_id,
                 'modalities': modalities_str,
@@ -521,144 +934,156 @@ def main():
                 'mem_gb': str(mem_gb)
             }
 
-            st.info(f"🚀 Sending to: {API_BASE}/run-mriqc")
-            st.warning("⏳ Processing takes ~10 minutes. Please wait...")
-
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            try:
-                progress_bar.progress(10)
-                status_text.text("Uploading BIDS dataset...")
-
-                with st.spinner("Processing on server... This may take several minutes."):
-                    # ✅ correct var (data) + stream enabled
-                    response = requests.post(
-                        f"{API_BASE}/run-mriqc",
-                        files=files,
-                        data=data,                    # <-- FIXED
-                        timeout=(120, 7200),
-                        stream=True
-                    )
-
-                # If backend returned an error, surface it now
-                if response.status_code != 200:
-                    # try to show structured detail if available
-                    try:
-                        detail = response.json().get("detail")
-                        st.error(
-                            f"❌ MRIQC failed ({response.status_code}): {detail}")
-                    except Exception:
-                        st.error(f"❌ MRIQC failed ({response.status_code})")
-                        st.error(response.text[:800])
-                    st.stop()
-
-                progress_bar.progress(50)
-                status_text.text(
-                    "Processing completed, downloading results...")
-
-                # ✅ Save streamed ZIP to disk with progress
-                result_zip_path = Path("mriqc_results.zip")
-                total = int(response.headers.get("Content-Length") or 0)
-                downloaded = 0
-
-                with open(result_zip_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=1024 * 256):
-                        if not chunk:
-                            continue
-                        f.write(chunk)
-                        if total:
-                            downloaded += len(chunk)
-                            # map 50->95% during download
-                            pct = 50 + int(45 * (downloaded / total))
-                            progress_bar.progress(min(pct, 95))
-
-                # ✅ Validate the ZIP
-                if not result_zip_path.exists() or result_zip_path.stat().st_size == 0:
-                    st.error("❌ Received empty file from backend.")
-                    st.stop()
-
+            job = st.session_state.get("mriqc_job")
+            if job is not None and not job.done():
+                st.warning("An MRIQC run is already in progress.")
+            else:
+                progress = {"pct": 10, "stage": "Uploading BIDS dataset..."}
+                # Lives in the scratch dir, so the next conversion or exit frees it
+                result_zip_path = temp_dir / "mriqc_results.zip"
+                result_zip_path.unlink(missing_ok=True)
+                st.session_state.mriqc_progress = progress
+                st.session_state.mriqc_result_path = str(result_zip_path)
+                st.session_state.mriqc_job = _start_mriqc_job(
+                    _session(), f"{API_BASE}/run-mriqc",
+                    bids_zip_path, data, result_zip_path, progress)
+
+        job = st.session_state.get("mriqc_job")
+        if job is not None:
+            progress = st.session_state.mriqc_progress
+            if not job.done():
+                st.info(f"🚀 Sending to: {API_BASE}/run-mriqc")
+                st.warning("⏳ Processing takes ~10 minutes. Please wait...")
+                st.progress(progress["pct"])
+                st.text(progress["stage"])
+                # Poll: the request runs in the worker, this rerun just redraws
+                time.sleep(2)
+                st.experimental_rerun()
+            show_mriqc_results(
+                job, Path(st.session_state.mriqc_result_path), subj_id)
+
+
+def load_mriqc_reports(result_zip_path: Path) -> dict:
+    # Reports are read straight from the archive; nothing is extracted
+    reports = {"files": [], "tsv": [], "html": []}
+    with zipfile.ZipFile(result_zip_path) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or any(fnmatch.fnmatchcase(info.filename, pattern)
+                                    for pattern in _ARCHIVE_JUNK):
+                continue
+            reports["files"].append(info.filename)
+            name = Path(info.filename).name
+            if name.endswith(".tsv"):
                 try:
-                    with zipfile.ZipFile(result_zip_path, "r") as zf:
-                        zf.testzip()  # quick integrity check
-                except zipfile.BadZipFile:
-                    ct = response.headers.get("content-type", "")
-                    cd = response.headers.get("content-disposition", "")
-                    st.error("❌ Response was not a valid ZIP file.")
-                    st.info(f"content-type: {ct}")
-                    st.info(f"content-disposition: {cd}")
-                    st.stop()
-
-                progress_bar.progress(96)
-                status_text.text("Extracting results...")
-
-                # ✅ Extract to a fresh folder
-                extract_dir = Path("mriqc_results")
-                if extract_dir.exists():
-                    shutil.rmtree(extract_dir, ignore_errors=True)
-                extract_dir.mkdir(parents=True, exist_ok=True)
-
-                with zipfile.ZipFile(result_zip_path, "r") as zf:
-                    zf.extractall(extract_dir)
-
-                progress_bar.progress(100)
-                status_text.text("Complete!")
-                st.success(
-                    "✅ MRIQC completed successfully and results were received.")
-
-                # ---- UI: Download button
-                with open(result_zip_path, "rb") as f:
-                    st.download_button(
-                        label="⬇️ Download MRIQC Results ZIP",
-                        data=f,
-                        file_name=f"mriqc_results_{subj_id}.zip",
-                        mime="application/zip"
-                    )
+                    with zf.open(info) as fh:
+                        reports["tsv"].append((name, pd.read_csv(fh, sep="\t"), None))
+                except Exception as e:
+                    reports["tsv"].append((name, None, e))
+            elif name.endswith(".html"):
+                try:
+                    # One bulk read + decode; stray bytes no longer abort the render
+                    reports["html"].append(
+                        (name, zf.read(info).decode("utf-8", errors="replace"), None))
+                except Exception as e:
+                    reports["html"].append((name, None, e))
+    return reports
+
+
+def show_mriqc_results(job, result_zip_path: Path, subj_id: str):
+    progress_bar = st.progress(95)
+    status_text = st.empty()
+
+    try:
+        result = job.result()
+
+        # If backend returned an error, surface it now
+        if result["status"] != 200:
+            if result["detail"] is not None:
+                st.error(
+                    f"❌ MRIQC failed ({result['status']}): {result['detail']}")
+            else:
+                st.error(f"❌ MRIQC failed ({result['status']})")
+                st.error(result["text"])
+            st.stop()
+
+        # ✅ Validate the ZIP
+        if not result_zip_path.exists() or result_zip_path.stat().st_size == 0:
+            st.error("❌ Received empty file from backend.")
+            st.stop()
+
+        # Decode the reports once per job; reruns reuse the strings
+        reports = st.session_state.get("mriqc_reports")
+        if reports is None or reports["job"] is not job:
+            try:
+                reports = load_mriqc_reports(result_zip_path)
+            except zipfile.BadZipFile:
+                st.error("❌ Response was not a valid ZIP file.")
+                st.info(f"content-type: {result['content_type']}")
+                st.info(f"content-disposition: {result['content_disposition']}")
+                st.stop()
+            reports["job"] = job
+            st.session_state.mriqc_reports = reports
+
+        progress_bar.progress(100)
+        status_text.text("Complete!")
+        st.success(
+            "✅ MRIQC completed successfully and results were received.")
+
+        # ---- UI: Download button
+        with open(result_zip_path, "rb") as f:
+            st.download_button(
+                label="⬇️ Download MRIQC Results ZIP",
+                data=f,
+                file_name=f"mriqc_results_{subj_id}.zip",
+                mime="application/zip"
+            )
 
-                # ---- UI: Preview contents (TSV + HTML)
-                st.subheader("📁 Results Summary")
-                files_listed = [p.relative_to(extract_dir).as_posix()
-                                for p in extract_dir.rglob("*") if p.is_file()]
-                if files_listed:
-                    st.write(f"Found **{len(files_listed)}** files.")
-                    st.code("\n".join(sorted(files_listed[:100])))
-
-                tsv_files = list(extract_dir.rglob("*.tsv"))
-                if tsv_files:
-                    st.subheader("📊 Quality Metrics (TSV)")
-                    for tsv in tsv_files:
-                        st.write(f"**{tsv.name}**")
-                        try:
-                            df = pd.read_csv(tsv, sep="\t")
-                            st.dataframe(df)
-                        except Exception as e:
-                            st.warning(f"Could not read {tsv.name}: {e}")
+        # ---- UI: Preview contents (TSV + HTML)
+        # Elements still have to be emitted on every rerun or Streamlit drops them
+        st.subheader("📁 Results Summary")
+        files_listed = reports["files"]
+        if files_listed:
+            st.write(f"Found **{len(files_listed)}** files.")
+            st.code("\n".join(sorted(files_listed[:100])))
+
+        if reports["tsv"]:
+            st.subheader("📊 Quality Metrics (TSV)")
+            for tsv_name, df, error in reports["tsv"]:
+                st.write(f"**{tsv_name}**")
+                if error:
+                    st.warning(f"Could not read {tsv_name}: {error}")
                 else:
-                    st.info("No TSV metrics found.")
-
-                html_files = list(extract_dir.rglob("*.html"))
-                if html_files:
-                    st.subheader("🧠 MRIQC HTML Reports")
-                    for html_path in html_files:
-                        try:
-                            with open(html_path, "r", encoding="utf-8") as fh:
-                                st.components.v1.html(
-                                    fh.read(), height=700, scrolling=True)
-                        except Exception as e:
-                            st.warning(
-                                f"Could not render {html_path.name}: {e}")
+                    st.dataframe(df)
+        else:
+            st.info("No TSV metrics found.")
+
+        if reports["html"]:
+            st.subheader("🧠 MRIQC HTML Reports")
+            for report_name, report_html, error in reports["html"]:
+                if error:
+                    st.warning(f"Could not render {report_name}: {error}")
                 else:
-                    st.info("No HTML reports found.")
-            except requests.exceptions.Timeout:
-                st.error("❌ Request timed out — processing took too long.")
-            except Exception as e:
-                st.error(f"❌ Unexpected error: {e}")
+                    st.components.v1.html(
+                        report_html, height=700, scrolling=True)
+        else:
+            st.info("No HTML reports found.")
+    except requests.exceptions.Timeout:
+        st.error("❌ Request timed out — processing took too long.")
+    except Exception as e:
+        st.error(f"❌ Unexpected error: {e}")
 
 
 # ------------------------------
 # Footer and Branding
 # ------------------------------
 
+
+@st.cache_resource
+def _logo_bytes() -> bytes:
+    # Read once per process; the footer is redrawn on every rerun
+    return Path("MLAB.png").read_bytes()
+
+
 # Container with collective padding
 st.markdown("""
     <div style="padding: 100px;">
@@ -668,7 +1093,7 @@ st.markdown("""
 col1, col2 = st.columns([1, 3])
 
 with col1:
-    st.image("MLAB.png", width=250)
+    st.image(_logo_bytes(), width=250)
 
 with col2:
     st.markdown(